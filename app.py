@@ -1,112 +1,198 @@
 import os
+import hashlib
 import sqlite3
-import arxiv
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-import schedule
 import threading
-from flask import Flask, render_template, request, g
+from flask import Flask, render_template, request, make_response
+from jinja2 import FileSystemBytecodeCache
 from collections import namedtuple
-from datetime import datetime, timedelta
+from functools import lru_cache
+from xml.etree import ElementTree
+from datetime import datetime, timedelta, timezone
 
 Paper = namedtuple('Paper', ['title', 'authors', 'published_date', 'summary', 'pdf_url', 'timestamp'])
 
 # checks for environment variable to set up the database file path
 DATABASE = os.environ.get('DATABASE_PATH', 'research.db')
 KEYWORDS_FILE = os.environ.get('KEYWORDS_PATH', 'keywords.txt')
+LAST_RUN_FILE = os.environ.get('LAST_RUN_PATH', 'last_run.txt')
+# set RUN_SCHEDULER=0 when searches are driven externally by `flask search` from cron
+RUN_SCHEDULER = os.environ.get('RUN_SCHEDULER', '1') != '0'
+# number of papers shown per dashboard page
+PAPERS_PER_PAGE = 50
+# highest page the dashboard will serve, keeping the query offset well inside SQLite's integer range
+MAX_PAGE = 100000
+# how often the background bot searches ArXiv
+SEARCH_INTERVAL_SECONDS = 60 * 60
+ARXIV_API_URL = 'https://export.arxiv.org/api/query'
+ATOM_NS = {'atom': 'http://www.w3.org/2005/Atom'}
+# searches never look back further than this
+SEARCH_WINDOW = timedelta(days=30)
+# arXiv only lists a paper once it is announced; weekends, holidays and moderation holds
+# can put that several days after submission, so each search reaches back a full week
+ANNOUNCEMENT_LAG = timedelta(days=7)
 
 app = Flask(__name__)
+# keep compiled templates on disk so restarted workers skip recompiling them
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+# part of every dashboard ETag, so a restart with new templates never serves a stale page
+STARTED_AT = str(time.time())
 
 # my database functions
 
+# each thread keeps one open connection, since sqlite3 connections can't be shared across threads
+_local = threading.local()
+
 def get_db():
-    """establishes a database connection or returns the existing one."""
-    db = getattr(g, '_database', None)
+    """establishes this thread's database connection or returns the existing one."""
+    db = getattr(_local, 'database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db = _local.database = sqlite3.connect(DATABASE)
         # allows for accessing columns by name
         db.row_factory = sqlite3.Row
+        # per-connection tuning; WAL itself is switched on once in init_db
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('PRAGMA temp_store=MEMORY')
+        db.execute('PRAGMA mmap_size=268435456')
+        db.execute('PRAGMA cache_size=-20000')
     return db
 
-@app.teardown_appcontext
-def close_connection(exception):
-    """closes the database connection at the end of the request."""
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
-
 def init_db():
     """initializes the database schema without the arxiv_id column."""
-    with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS papers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT UNIQUE NOT NULL,
-                authors TEXT,
-                published_date TEXT,
-                summary TEXT,
-                pdf_url TEXT,
-                timestamp TEXT
-            )
-        ''')
-        db.commit()
-        print(f"Database file located at: {os.path.abspath(DATABASE)}")
-
-def insert_paper(paper):
-    """inserts a new paper into the database if it doesn't already exist."""
-    try:
-        with app.app_context():
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('''
-                INSERT INTO papers (title, authors, published_date, summary, pdf_url, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (paper.title, paper.authors, paper.published_date, paper.summary, paper.pdf_url, paper.timestamp))
-            db.commit()
-            return True
-    except sqlite3.IntegrityError:
-        print(f"Paper with title '{paper.title}' already exists. Skipping insertion.")
-        return False
-
-def fetch_papers():
-    """Fetches all papers from the database, ordered by log time."""
-    with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('SELECT * FROM papers ORDER BY timestamp DESC')
-        papers = cursor.fetchall()
-        return [Paper(
-            title=p['title'],
-            authors=p['authors'],
-            published_date=p['published_date'],
-            summary=p['summary'],
-            pdf_url=p['pdf_url'],
-            timestamp=p['timestamp']
-        ) for p in papers]
+    db = get_db()
+    # WAL turns commits into appends and lets the dashboard read while the bot writes;
+    # the mode is stored in the database file so it only has to be set once
+    db.execute('PRAGMA journal_mode=WAL')
+    cursor = db.cursor()
+    # title is the only UNIQUE key; id is a plain rowid alias, since AUTOINCREMENT would
+    # also rewrite the sqlite_sequence table on every insert
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS papers (
+            id INTEGER PRIMARY KEY,
+            title TEXT UNIQUE NOT NULL,
+            authors TEXT,
+            published_date TEXT,
+            summary TEXT,
+            pdf_url TEXT,
+            timestamp TEXT
+        )
+    ''')
+    # the dashboard pages through papers newest first
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_papers_timestamp ON papers (timestamp DESC)')
+    db.commit()
+    print(f"Database file located at: {os.path.abspath(DATABASE)}")
+
+# the UNIQUE title constraint does the dedup, so duplicates are skipped in SQL;
+# kept as one constant so sqlite3's statement cache always sees the same text
+INSERT_PAPER_SQL = '''
+    INSERT OR IGNORE INTO papers (title, authors, published_date, summary, pdf_url, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def insert_papers(papers):
+    """inserts a batch of papers into the database, ignoring any that already exist.
+
+    returns the number of papers that were actually added.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    cursor.executemany(INSERT_PAPER_SQL, papers)
+    db.commit()
+    return cursor.rowcount
+
+def fetch_papers(limit=PAPERS_PER_PAGE, offset=0):
+    """Fetches one page of papers from the database, ordered by log time."""
+    db = get_db()
+    cursor = db.cursor()
+    # columns are listed in Paper field order so rows map straight onto the tuple;
+    # a run's papers share one timestamp, so id breaks the tie to keep pages stable
+    cursor.execute('''
+        SELECT title, authors, published_date, summary, pdf_url, timestamp
+        FROM papers ORDER BY timestamp DESC, id LIMIT ? OFFSET ?
+    ''', (limit, offset))
+    return [Paper._make(p) for p in cursor]
+
+def fetch_log_state():
+    """returns the log time and id of the most recently logged paper, both None if there are none.
+
+    both come straight off an index, so this is cheap enough to check on every pageview.
+    """
+    db = get_db()
+    # separate subqueries so sqlite can use its single-aggregate MIN/MAX shortcut for each
+    return tuple(db.execute('SELECT (SELECT MAX(timestamp) FROM papers), (SELECT MAX(id) FROM papers)').fetchone())
 
 # my keyword management functions 
 
+# parsed keywords plus the file mtime they were read at, so unchanged files aren't re-read
+_keywords_cache = {'mtime': None, 'keywords': []}
+
 def save_keywords(keywords_string):
     """saves keywords to a file."""
     with open(KEYWORDS_FILE, 'w') as f:
         f.write(keywords_string)
+    # force the next load to re-read, even if the mtime didn't visibly change
+    _keywords_cache['mtime'] = None
     print(f"Keywords file located at: {os.path.abspath(KEYWORDS_FILE)}")
 
 def load_keywords():
-    """loads keywords from a file."""
-    if os.path.exists(KEYWORDS_FILE):
+    """loads keywords from a file, only re-parsing it when it has changed."""
+    try:
+        mtime = os.stat(KEYWORDS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    if mtime != _keywords_cache['mtime']:
         with open(KEYWORDS_FILE, 'r') as f:
             keywords_string = f.read().strip()
-            return [k.strip() for k in keywords_string.split(',') if k.strip()]
-    return []
+        _keywords_cache['keywords'] = [k.strip() for k in keywords_string.split(',') if k.strip()]
+        _keywords_cache['mtime'] = mtime
+    return _keywords_cache['keywords']
+
+# my last run tracking functions
+
+def keywords_fingerprint(keywords):
+    """returns a short hash of the ArXiv query the given keywords turn into."""
+    return hashlib.blake2b(build_keyword_query(tuple(keywords)).encode(), digest_size=8).hexdigest()
+
+def save_last_run(when, keywords):
+    """records when the last successful search was started, and for which keywords."""
+    with open(LAST_RUN_FILE, 'w') as f:
+        f.write(f"{when.isoformat()}\n{keywords_fingerprint(keywords)}\n")
+
+def load_last_run(keywords):
+    """returns when the last successful search for these keywords was started.
+
+    returns None if there hasn't been one, or if the last run searched for different
+    keywords, so that new keywords always get the full search window.
+    """
+    try:
+        with open(LAST_RUN_FILE, 'r') as f:
+            when, fingerprint = f.read().split()
+        if fingerprint != keywords_fingerprint(keywords):
+            return None
+        return datetime.fromisoformat(when)
+    except (FileNotFoundError, ValueError):
+        return None
 
 
 # my arXiv bot logic
 
-def search_arxiv(keywords, max_results=20):
-    """searches ArXiv for papers matching the given keywords, limited to the last month."""
-    # Build the query string by handling single and multi-word keywords
+# one shared session keeps the connection to ArXiv alive between searches and
+# retries rate limits and gateway errors with exponential backoff
+SESSION = requests.Session()
+SESSION.headers.update({'Accept-Encoding': 'gzip', 'User-Agent': 'ResearcherPilot/1.0'})
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(
+    total=3, backoff_factor=1, status_forcelist=[429, 502, 503, 504]
+)))
+
+@lru_cache(maxsize=16)
+def build_keyword_query(keywords):
+    """builds the OR'd keyword part of the ArXiv query, quoting multi-word keywords.
+
+    takes a tuple so the result can be cached; keywords rarely change between runs.
+    """
     query_parts = []
     for k in keywords:
         k = k.strip()
@@ -114,47 +200,107 @@ def search_arxiv(keywords, max_results=20):
             query_parts.append(f'"{k}"')
         else:
             query_parts.append(k)
+    return " OR ".join(query_parts)
+
+def parse_arxiv_feed(feed):
+    """parses an ArXiv Atom feed from a file-like object into papers, one entry at a time.
+
+    the papers have no timestamp yet; that is set when they are logged.
+    """
+    entry_tag = '{%s}entry' % ATOM_NS['atom']
+    for _, entry in ElementTree.iterparse(feed):
+        if entry.tag != entry_tag:
+            continue
+        pdf_link = entry.find("atom:link[@title='pdf']", ATOM_NS)
+        yield Paper(
+            # titles and summaries come hard-wrapped, so collapse the whitespace
+            title=' '.join(entry.findtext('atom:title', '', ATOM_NS).split()),
+            authors=", ".join(name.text for name in entry.iterfind('atom:author/atom:name', ATOM_NS)),
+            # published is an ISO timestamp, so the date is just its first ten characters
+            published_date=entry.findtext('atom:published', '', ATOM_NS)[:10],
+            summary=' '.join(entry.findtext('atom:summary', '', ATOM_NS).split()),
+            pdf_url=pdf_link.get('href') if pdf_link is not None else None,
+            timestamp=None
+        )
+        # drop the parsed entry so memory stays flat however many results come back
+        entry.clear()
+
+def search_arxiv(keywords, max_results=20, since=None):
+    """searches ArXiv for papers matching the given keywords, submitted since the given time.
 
-    query_string = " OR ".join(query_parts)
+    the search never reaches back more than a month. returns None if the search failed.
+    """
+    query_string = build_keyword_query(tuple(keywords))
 
     if not query_string:
         return []
 
-    # Should start pulling papers from one month ago to most recent to narrow search
-    one_month_ago = datetime.now() - timedelta(days=30)
-    query_string = f"({query_string}) AND submittedDate:[{one_month_ago.strftime('%Y%m%d')} TO {datetime.now().strftime('%Y%m%d')}]"
-    
+    # arXiv filters on submission time (GMT) server-side, so only the new slice comes back
+    now = datetime.now(timezone.utc)
+    start = now - SEARCH_WINDOW
+    if since is not None:
+        start = max(start, since - ANNOUNCEMENT_LAG)
+    query_string = f"({query_string}) AND submittedDate:[{start:%Y%m%d%H%M} TO {now:%Y%m%d%H%M}]"
+
     try:
-        search = arxiv.Search(
-            query=query_string,
-            max_results=max_results,
-            sort_by=arxiv.SortCriterion.SubmittedDate
-        )
-        return list(search.results())
+        # max_results stays well under the API's per-request cap, so one request returns everything
+        with SESSION.get(ARXIV_API_URL, params={
+            'search_query': query_string,
+            'max_results': max_results,
+            'sortBy': 'submittedDate',
+            'sortOrder': 'descending'
+        }, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            # parse straight off the socket instead of buffering the whole body first;
+            # the raw stream has to be told to undo the gzip encoding itself
+            response.raw.decode_content = True
+            return list(parse_arxiv_feed(response.raw))
     except Exception as e:
         print(f"An error occurred while searching ArXiv: {e}")
-        return []
+        return None
+
+# only one search may run at a time, whether started by the schedule or the dashboard
+search_lock = threading.Lock()
 
 def perform_search_and_log():
     """performs the ArXiv search and logs new papers to the database."""
-    print(f"[{datetime.now()}] Performing scheduled search...")
-    keywords = load_keywords()
-    if not keywords:
-        print("no keywords found. Skipping search.")
+    if not search_lock.acquire(blocking=False):
+        print("A search is already running. Skipping.")
         return
+    _search_and_log_holding_lock()
 
-    papers = search_arxiv(keywords)
-    for paper in papers:
-
-        new_paper = Paper(
-            title=paper.title,
-            authors=", ".join(author.name for author in paper.authors),
-            published_date=paper.published.strftime('%Y-%m-%d'),
-            summary=paper.summary,
-            pdf_url=paper.pdf_url,
-            timestamp=datetime.now().strftime('%Y-%m-%S')
-        )
-        insert_paper(new_paper)
+def _search_and_log_holding_lock():
+    """does the work of perform_search_and_log; the caller must already hold search_lock,
+    which is released once the search is finished."""
+    try:
+        print(f"[{datetime.now()}] Performing scheduled search...")
+        keywords = load_keywords()
+        if not keywords:
+            print("no keywords found. Skipping search.")
+            return
+
+        run_started = datetime.now(timezone.utc)
+        papers = search_arxiv(keywords, since=load_last_run(keywords))
+        if papers is None:
+            # leave the last run alone so the next search covers this one's window too
+            return
+        # every paper in a run shares the same log time
+        logged_at = datetime.now().isoformat(sep=' ', timespec='seconds')
+        new_papers = [paper._replace(timestamp=logged_at) for paper in papers]
+        inserted = insert_papers(new_papers)
+        print(f"Logged {inserted} new papers, skipped {len(new_papers) - inserted} already in the database.")
+        save_last_run(run_started, keywords)
+    finally:
+        search_lock.release()
+
+def start_background_search():
+    """runs a search and log on its own thread so the caller doesn't wait on ArXiv."""
+    if not search_lock.acquire(blocking=False):
+        print("A search is already running. Skipping.")
+        return
+    # the lock is taken before the thread starts, so the dashboard we redirect to
+    # already shows the search as running
+    threading.Thread(target=_search_and_log_holding_lock, daemon=True).start()
 
 # flask app routes
 
@@ -166,13 +312,24 @@ def index():
 @app.route('/dashboard')
 def dashboard():
     """renders the main bot dashboard with logged papers and current keywords."""
-    init_db()
-    papers = fetch_papers()
+    page = min(max(request.args.get('page', 1, type=int), 1), MAX_PAGE)
     current_keywords = ",".join(load_keywords())
-    last_researched = None
-    if papers:
-        last_researched = papers[0].timestamp
-    return render_template('dashboard.html', papers=papers, current_keywords=current_keywords, last_researched=last_researched)
+    last_researched, latest_id = fetch_log_state()
+    search_running = search_lock.locked()
+    # the page only changes when a paper is logged, the keywords change or a search starts or ends
+    etag = hashlib.blake2b(f"{STARTED_AT}|{latest_id}|{last_researched}|{current_keywords}|{page}|{search_running}".encode(), digest_size=8).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        # fetch one extra row to find out whether there is an older page
+        papers = fetch_papers(PAPERS_PER_PAGE + 1, (page - 1) * PAPERS_PER_PAGE)
+        has_next = len(papers) > PAPERS_PER_PAGE
+        papers = papers[:PAPERS_PER_PAGE]
+        response = make_response(render_template('dashboard.html', papers=papers, current_keywords=current_keywords, last_researched=last_researched, page=page, has_next=has_next, search_running=search_running))
+    response.set_etag(etag)
+    # let browsers keep the page but check back with us before showing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/save_keywords', methods=['POST'])
@@ -185,22 +342,34 @@ def save_keywords_route():
 
 @app.route('/fetch_and_log')
 def fetch_and_log():
-    """manually triggers a search and log."""
-    perform_search_and_log()
+    """manually triggers a search and log without holding up the request."""
+    start_background_search()
     return app.redirect('/dashboard')
 
 def run_scheduled_bot():
-    """runs the scheduled bot in a separate thread."""
+    """runs the scheduled bot in a separate thread, sleeping until each hourly search is due."""
+    next_run = time.monotonic() + SEARCH_INTERVAL_SECONDS
     while True:
-        schedule.run_pending()
-        time.sleep(1)
-# schedules my bot to check for new papers every hour, then start a background thread to run the schedule
-schedule.every(1).hour.do(perform_search_and_log)
-with app.app_context():
-    init_db()
-
-bot_thread = threading.Thread(target=run_scheduled_bot, daemon=True)
-bot_thread.start()
+        time.sleep(max(0, next_run - time.monotonic()))
+        try:
+            perform_search_and_log()
+        except Exception as e:
+            # one bad run must not kill the thread and silently stop every later search
+            print(f"An error occurred during the scheduled search: {e}")
+        # keep to the hourly cadence however long the search itself took
+        next_run += SEARCH_INTERVAL_SECONDS
+
+@app.cli.command('search')
+def search_command():
+    """runs a single search and log, then exits; meant to be scheduled by cron."""
+    perform_search_and_log()
+
+init_db()
+
+# my bot checks for new papers every hour from a background thread, unless cron does it
+if RUN_SCHEDULER:
+    bot_thread = threading.Thread(target=run_scheduled_bot, daemon=True)
+    bot_thread.start()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0')